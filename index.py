@@ -1,89 +1,30 @@
 import dash
-from dash import html, dcc, Input, Output
+from dash import html, dcc, Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import plotly.express as px
 import pandas as pd
-from dash_bootstrap_templates import ThemeSwitchAIO
-import plotly.graph_objects as go
-import json
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from dash_bootstrap_templates import ThemeSwitchAIO, load_figure_template
+import plotly.io as pio
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import hashlib
+import threading
+import time
 from dotenv import load_dotenv
+from flask_caching import Cache
 
 # Carregar variáveis de ambiente
 load_dotenv()
 
-# Inicializar variáveis globais
-df = None
-data_loaded = False
-cobs = None
-
-# Função para calcular o total de viaturas únicas em cada linha
-def calcular_total_vtr(linha):
-    return len(set(linha.split(' / ')))
-
-# Função para carregar e processar os dados da API
-# Função para carregar e processar os dados da API
-def load_data(force_reload=False):
-    global df, cobs, data_loaded
-
-    # Se `force_reload=True`, força a atualização dos dados
-    if force_reload or not data_loaded:
-        url = os.environ.get("URL_API")
-        headers = {
-            'Cache-Control': 'no-cache, no-store, must-revalidate',
-            'Pragma': 'no-cache',
-            'Expires': '0'
-        }
-        response = requests.get(url, headers=headers)
-
-        df = pd.DataFrame(response.json())
-
-        # Converter colunas com valores repetidos para category
-        categorical_columns = ["Natureza", "Prioridade", "tipo_classificacao", "COB", "UNIDADE", "municipio"]
-        for col in categorical_columns:
-            df[col] = df[col].astype("category")
-
-        # Converter latitude e longitude para float32
-        df["latitude"] = df["latitude"].astype("float32")
-        df["longitude"] = df["longitude"].astype("float32")
-
-        # Converter a coluna data para datetime
-        df["data"] = pd.to_datetime(df["data"], format="%d/%m/%Y")
-
-        # Mapear COBs e Prioridades
-        cob_legend = {
-            '1COB': '1ºCOB - RMBH/Divinóplis',
-            '2COB': '2ºCOB - Uberlândia',
-            '3COB': '3ºCOB - Juiz de Fora',
-            '4COB': '4ºCOB - Montes Claros',
-            '5COB': '5ºCOB - Governador Valadares',
-            '6COB': '6ºCOB - Varginha'
-        }
-        df['COB_nome'] = df['COB'].map(cob_legend)
-
-        priori_legend = {
-            '1': 'Prioridade 1 - Alta',
-            '2': 'Prioridade 2 - Média',
-            '3': 'Prioridade 3 - Baixa'
-        }
-        df['Prioridade_nome'] = df['Prioridade'].map(priori_legend)
-
-        # Criando a coluna 'total_vtr'
-        df['total_vtr'] = df['recursos_empenhados'].apply(calcular_total_vtr)
-
-        # Lista de Cobs Única e Ordenada
-        cobs = sorted(df["COB_nome"].dropna().astype(str).unique())
-
-        # Atualizar estado
-        data_loaded = True
-
-
-load_data()
-
-# Configurar valores iniciais e finais para o filtro de data
-data_min = df["data"].min().date()
-data_max = df["data"].max().date()
+# Intervalo de atualização do painel (em segundos)
+intervalo_atualizacao = 60
 
 # Configuração do Dash (Stylesheet e título) ==========================
 app = dash.Dash(
@@ -95,7 +36,339 @@ template_theme1 = "vapor"
 template_theme2 = "flatly"
 url_theme1 = dbc.themes.VAPOR
 url_theme2 = dbc.themes.FLATLY
+load_figure_template([template_theme1, template_theme2])
+
+# Serialização JSON das figuras e das respostas dos callbacks com orjson
+# (o Dash usa o mesmo motor do plotly.io)
+pio.json.config.default_engine = "orjson"
+
+# Configuração do Cache ===============================================
+# Redis quando disponível; sem ele, cache em disco, que também é
+# compartilhado entre os workers do gunicorn e sobrevive a reinícios
+redis_url = os.environ.get("REDIS_URL")
+if redis_url:
+    cache_config = {'CACHE_TYPE': 'RedisCache', 'CACHE_REDIS_URL': redis_url}
+else:
+    cache_config = {'CACHE_TYPE': 'FileSystemCache', 'CACHE_DIR': os.environ.get("CACHE_DIR", ".cache")}
+cache = Cache(app.server, config=cache_config)
+
+# Legendas dos códigos de COB e Prioridade
+cob_legend = {
+    '1COB': '1ºCOB - RMBH/Divinóplis',
+    '2COB': '2ºCOB - Uberlândia',
+    '3COB': '3ºCOB - Juiz de Fora',
+    '4COB': '4ºCOB - Montes Claros',
+    '5COB': '5ºCOB - Governador Valadares',
+    '6COB': '6ºCOB - Varginha'
+}
+
+priori_legend = {
+    '1': 'Prioridade 1 - Alta',
+    '2': 'Prioridade 2 - Média',
+    '3': 'Prioridade 3 - Baixa'
+}
+
+# Lista de Cobs Única e Ordenada, fixa a partir da legenda
+cobs = sorted(cob_legend.values())
+
+# Somas de colunas do resumo diário por combinação de categorias, sem as
+# combinações ausentes no filtro (como um groupby com observed=True)
+# Os códigos das colunas category viram um único índice por combinação, que
+# indexa direto os acumuladores (np.bincount), sem a tabela de hash de um
+# groupby; linhas sem categoria (código -1) ficam de fora
+def somar_por_categorias(resumo, colunas, valores):
+    chaves = [resumo[coluna] for coluna in colunas]
+    tamanhos = tuple(len(chave.cat.categories) for chave in chaves)
+    codigos = [chave.cat.codes.to_numpy() for chave in chaves]
+    validos = np.logical_and.reduce([codigo >= 0 for codigo in codigos])
+    combinados = np.ravel_multi_index([codigo[validos] for codigo in codigos], tamanhos)
+    total = int(np.prod(tamanhos))
+    presentes = np.flatnonzero(np.bincount(combinados, minlength=total))
+    tabela = {
+        coluna: pd.Categorical.from_codes(posicoes, categories=chave.cat.categories)
+        for coluna, chave, posicoes in zip(colunas, chaves, np.unravel_index(presentes, tamanhos))
+    }
+    for valor in valores:
+        somas = np.bincount(combinados, weights=resumo[valor].to_numpy()[validos], minlength=total)
+        tabela[valor] = somas[presentes].astype(np.int64)
+    return pd.DataFrame(tabela)
+
+# Contagem de ocorrências por categoria a partir do resumo diário
+def contar_ocorrencias(resumo, coluna):
+    return somar_por_categorias(resumo, [coluna], ["Quantidade"]).set_index(coluna)["Quantidade"]
+
+# Colunas do resumo diário: cada combinação distinta vira uma linha com a
+# quantidade de ocorrências e o total de viaturas empenhadas
+colunas_resumo = ["data", "COB_nome", "Prioridade", "Prioridade_nome", "UNIDADE", "municipio", "Natureza"]
+
+# Agrega as ocorrências uma vez por atualização; os callbacks filtram e
+# reagrupam esta tabela menor em vez de percorrer todas as ocorrências
+# dropna=False mantém as linhas sem COB ou Prioridade mapeados nas contagens
+# As contagens são reduzidas ao menor inteiro sem sinal que as comporta
+def resumir_por_dia(df):
+    resumo = df.groupby(colunas_resumo, observed=True, dropna=False).agg(
+        Quantidade=("total_vtr", "size"),
+        TotalRecursos=("total_vtr", "sum"),
+    ).reset_index()
+    for col in ["Quantidade", "TotalRecursos"]:
+        resumo[col] = pd.to_numeric(resumo[col], downcast='unsigned')
+    return resumo
+
+# Máscara das linhas de uma coluna category com um dos valores pedidos
+# Usa os códigos inteiros das categorias, não os textos: uma tabela com uma
+# posição por categoria (e uma última para o código -1, sem categoria) é
+# indexada pelos códigos, gerando a máscara em uma única passada
+# Valores que não são categorias da coluna não selecionam nada
+def mascara_categorias(coluna, valores):
+    posicoes = coluna.cat.categories.get_indexer(list(valores))
+    selecionadas = np.zeros(len(coluna.cat.categories) + 1, dtype=bool)
+    selecionadas[posicoes[posicoes >= 0]] = True
+    return selecionadas[coluna.cat.codes.to_numpy()]
+
+# Linhas selecionadas pelos filtros de data e COB, para uso com iloc
+# DataFrame e resumo estão ordenados por data, então o período é um intervalo
+# de linhas achado por busca binária, sem comparar cada linha nem copiar os
+# dados; cada data do período pode faltar, e o limite correspondente fica aberto
+def linhas_filtradas(frame, start_date, end_date, cobs):
+    datas = frame["data"].to_numpy()
+    inicio, fim = 0, len(frame)
+    if start_date:
+        inicio = datas.searchsorted(pd.Timestamp(start_date).to_datetime64(), side="left")
+    if end_date:
+        fim = datas.searchsorted(pd.Timestamp(end_date).to_datetime64(), side="right")
+    linhas = slice(inicio, fim)
+    if cobs:
+        linhas = inicio + np.flatnonzero(mascara_categorias(frame["COB_nome"].iloc[linhas], cobs))
+    return linhas
+
+# Categoria com o maior valor, o valor e a média entre as categorias
+# Em caso de empate vence o menor nome, como no groupby ordenado original,
+# independente da ordem em que as contagens chegam
+# Se não houver registros válidos, exibe "—"
+def top_e_media(contagem):
+    if contagem.empty:
+        return "—", 0, 0
+    valores = contagem.to_numpy()
+    maximos = np.flatnonzero(valores == valores.max())
+    posicao = min(maximos, key=lambda i: str(contagem.index[i]))
+    return contagem.index[posicao], valores[posicao].item(), valores.mean().item()
+
+# Partes fixas das figuras de indicador
+indicador_numero = {'font': {'size': 40}}
+indicador_delta = {'relative': True, 'valueformat': '.1%', 'position': "bottom", 'font': {'size': 30}}
+
+# Figura de indicador montada direto como dicionário (o mesmo formato de
+# to_plotly_json), sem construir e validar um go.Figure a cada callback
+def figura_indicador(titulo, valor, sufixo, referencia=None, modo='number+delta'):
+    indicador = {
+        'type': 'indicator',
+        'mode': modo,
+        'title': {'text': titulo},
+        'value': valor,
+        'number': {'suffix': sufixo, **indicador_numero},
+    }
+    if referencia is not None:
+        indicador['delta'] = {**indicador_delta, 'reference': referencia}
+    return {'data': [indicador], 'layout': {}}
+
+# Gráfico de barras empilhadas montado direto como dicionário, com um trace
+# por valor de 'cor' na ordem em que aparece na tabela (como o px.bar), sem a
+# introspecção do DataFrame e a validação do plotly.express
+def figura_barras(tabela, x, cor, titulo, rotulos, cores):
+    traces = []
+    for posicao, (nome, grupo) in enumerate(tabela.groupby(cor, observed=True, sort=False)):
+        traces.append({
+            'type': 'bar',
+            'name': str(nome),
+            'legendgroup': str(nome),
+            'offsetgroup': str(nome),
+            'alignmentgroup': 'True',
+            'orientation': 'v',
+            'showlegend': True,
+            'textposition': 'auto',
+            'x': grupo[x].astype(str).tolist(),
+            'y': grupo['Quantidade'].tolist(),
+            'marker': {'color': cores[posicao % len(cores)], 'pattern': {'shape': ''}},
+            'hovertemplate': f"{rotulos[cor]}={nome}<br>{rotulos[x]}=%{{x}}<br>"
+                             f"{rotulos['Quantidade']}=%{{y}}<extra></extra>",
+        })
+    layout = {
+        'title': {'text': titulo},
+        'barmode': 'relative',
+        'xaxis': {'title': {'text': rotulos[x]}},
+        'yaxis': {'title': {'text': rotulos['Quantidade']}},
+        'legend': {'title': {'text': rotulos[cor]}, 'tracegroupgap': 0, 'traceorder': 'normal'},
+    }
+    return {'data': traces, 'layout': layout}
+
+# Troca os códigos de uma coluna category pelos nomes da legenda
+# A legenda é aplicada às categorias e os códigos de cada linha são apenas
+# reindexados; códigos sem legenda ficam vazios (NaN)
+# No caso comum, com todas as categorias na legenda e nomes distintos, só as
+# categorias são renomeadas e os códigos das linhas nem são percorridos
+def mapear_categorias(coluna, legenda):
+    categorias = coluna.cat.categories
+    if categorias.isin(list(legenda)).all() and len(set(legenda.values())) == len(legenda):
+        return coluna.cat.rename_categories(legenda)
+    nomes = pd.Index(list(legenda.values())).unique()
+    novos_codigos = nomes.get_indexer(categorias.map(legenda))
+    codigos = np.append(novos_codigos, -1)[coluna.cat.codes.to_numpy()]
+    return pd.Categorical.from_codes(codigos, categories=nomes)
+
+# Separa as viaturas de cada linha em uma lista do Arrow
+def separar_viaturas(recursos):
+    return pc.split_pattern(pa.array(recursos.fillna(""), type=pa.string()), " / ")
+
+# Total de viaturas distintas em todas as linhas, contado pelo Arrow
+# Recebe a coluna 'viaturas', já separada no carregamento
+def contar_viaturas_unicas(viaturas):
+    return pc.count_distinct(pc.list_flatten(pa.array(viaturas))).as_py()
+
+# Função para calcular o total de viaturas únicas em cada linha
+# Separa as viaturas e codifica cada uma como inteiro com os kernels do Arrow;
+# cada par (linha, viatura) distinto conta uma vez para a sua linha
+# Os pares repetidos são removidos por hash (pc.unique), sem ordenar
+def calcular_total_vtr(viaturas):
+    linhas = pc.list_parent_indices(viaturas).to_numpy()
+    codificadas = pc.dictionary_encode(pc.list_flatten(viaturas))
+    codigos = codificadas.indices.to_numpy()
+    total_codigos = max(len(codificadas.dictionary), 1)
+    pares = pc.unique(pa.array(linhas * total_codigos + codigos)).to_numpy()
+    return np.bincount(pares // total_codigos, minlength=len(viaturas))
+
+# Sessão HTTP compartilhada entre as atualizações
+# Mantém a conexão com a API aberta (keep-alive) e reaproveita o handshake TLS
+session = requests.Session()
+session.headers.update({
+    'Accept-Encoding': 'gzip',
+    'Cache-Control': 'no-cache, no-store, must-revalidate',
+    'Pragma': 'no-cache',
+    'Expires': '0'
+})
+adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4,
+                      max_retries=Retry(total=2, backoff_factor=0.2))
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+# Último conteúdo recebido da API e o DataFrame processado a partir dele
+last_hash = None
+last_df = None
+last_resumo = None
+last_etag = None
+
+# Função para buscar e processar os dados da API
+# Retorna o DataFrame e o hash do conteúdo, que serve como versão dos dados;
+# se a API devolver o mesmo conteúdo, reaproveita o último DataFrame processado
+# A requisição é condicional (ETag): se a API responder 304, nem baixa o corpo
+def fetch_data():
+    global last_hash, last_df, last_resumo, last_etag
+
+    url = os.environ.get("URL_API")
+    headers = {}
+    if last_df is not None and last_etag:
+        headers['If-None-Match'] = last_etag
+    response = session.get(url, headers=headers, timeout=10)
+    if response.status_code == 304:
+        return last_df, last_hash
+    # O ETag só é guardado depois que o conteúdo foi processado com sucesso;
+    # se o processamento falhar, a próxima atualização busca tudo de novo
+    etag = response.headers.get('ETag')
+
+    content_hash = hashlib.blake2b(response.content, digest_size=16).hexdigest()
+    if content_hash == last_hash:
+        last_etag = etag
+        return last_df, last_hash
+
+    df = pd.DataFrame(orjson.loads(response.content))
+
+    # Converter colunas com valores repetidos para category
+    categorical_columns = ["Natureza", "Prioridade", "tipo_classificacao", "COB", "UNIDADE", "municipio"]
+    for col in categorical_columns:
+        df[col] = df[col].astype("category")
+
+    # Converter colunas de texto livre para strings do Arrow (buffer contínuo,
+    # sem um objeto Python por linha)
+    text_columns = ["recursos_empenhados", "local_fato"]
+    for col in text_columns:
+        df[col] = df[col].astype(pd.ArrowDtype(pa.string()))
+
+    # Latitude e longitude só seriam usadas pelo mapa de prioridades, que está
+    # desativado no layout; descartá-las evita guardar e copiar as duas colunas
+    df = df.drop(columns=["latitude", "longitude"])
+
+    # Converter a coluna data para datetime e ordenar por ela, para que os
+    # filtros de período sejam fatias
+    df["data"] = pd.to_datetime(df["data"], format="%d/%m/%Y")
+    df = df.sort_values("data", kind="stable", ignore_index=True)
+
+    # Mapear COBs e Prioridades
+    # As colunas mapeadas continuam category, assim todos os groupby do callback
+    # usam os códigos das categorias
+    df['COB_nome'] = mapear_categorias(df['COB'], cob_legend)
+    df['Prioridade_nome'] = mapear_categorias(df['Prioridade'], priori_legend)
+
+    # Separar as viaturas uma única vez; a lista fica guardada em 'viaturas'
+    # para o total de viaturas únicas do callback
+    viaturas = separar_viaturas(df['recursos_empenhados'])
+    df['viaturas'] = pd.arrays.ArrowExtensionArray(viaturas)
+
+    # Criando a coluna 'total_vtr' (total de viaturas únicas em cada linha)
+    df['total_vtr'] = calcular_total_vtr(viaturas).astype('uint16')
+
+    last_hash, last_df, last_resumo, last_etag = content_hash, df, resumir_por_dia(df), etag
+    return df, content_hash
+
+# Atualiza o DataFrame e o resumo guardados no cache junto com a sua versão
+# O tempo de expiração cobre dois intervalos, caso uma atualização falhe
+def refresh_data():
+    df, versao = fetch_data()
+    cache.set_many({'df': df, 'resumo': last_resumo, 'data_version': versao}, timeout=2 * intervalo_atualizacao)
+    return df
+
+# Função para carregar os dados já processados
+# Os callbacks leem do cache; se ele expirou, usam o último DataFrame deste
+# processo enquanto a atualização em segundo plano busca a API, e só esperam
+# pela rede se nada foi carregado ainda
+# Retorna o DataFrame e o seu resumo diário
+def load_data():
+    df, resumo = cache.get_many('df', 'resumo')
+    if df is None or resumo is None:
+        if last_df is None:
+            refresh_data()
+        df, resumo = last_df, last_resumo
+    return df, resumo
+
+# Versão dos dados em cache, muda quando o conteúdo da API muda
+def get_data_version():
+    versao = cache.get('data_version')
+    if versao is None:
+        if last_hash is None:
+            refresh_data()
+        versao = last_hash
+    return versao
+
+# Atualização em segundo plano, fora do caminho dos callbacks
+def refresh_loop():
+    while True:
+        time.sleep(intervalo_atualizacao)
+        try:
+            refresh_data()
+        except Exception as e:
+            print(f"⚠️ Erro ao atualizar dados: {e}")
+
+
+df = refresh_data()
+threading.Thread(target=refresh_loop, daemon=True).start()
+
+# Configurar valores iniciais e finais para o filtro de data
+data_min = df["data"].min().date()
+data_max = df["data"].max().date()
 
+# Templates dos dois temas serializados uma vez, para a troca de tema no navegador
+figure_templates = {
+    "theme1": pio.templates[template_theme1].to_plotly_json(),
+    "theme2": pio.templates[template_theme2].to_plotly_json(),
+}
 
 # Layout do Dashboard ================================================
 app.layout = dbc.Container([
@@ -205,300 +478,221 @@ app.layout = dbc.Container([
     #         ])
     #     ])
     # ]),
-    dcc.Interval(id="interval-update", interval=60*1000, n_intervals=0) # Atualizar a cada 1 min
+    dcc.Interval(id="interval-update", interval=intervalo_atualizacao*1000, n_intervals=0), # Atualizar a cada 1 min
+
+    # Figuras calculadas no servidor (sem template), os filtros e a versão dos
+    # dados que as geraram, e os templates dos dois temas
+    dcc.Store(id="figures-store"),
+    dcc.Store(id="figures-key"),
+    dcc.Store(id="figure-templates", data=figure_templates),
 ], fluid=True)
 
 # Callbacks =========================================================
-@app.callback(
-    Output("indc_1", "figure"),
-    Output("indc_2", "figure"),
-    Output("indc_3", "figure"),
-    Output("indc_4", "figure"),
-    Output("indc_5", "figure"),
-    Output("indc_6", "figure"),
-    Output("indc_7", "figure"),
-    Output("indc_8", "figure"),
-    Output("cob_pri", "figure"),
-    Output("pri_pie", "figure"),
-    Output("cob_nat", "figure"),
-    #Output("map_priorities", "figure"),
-    Input("date-filter", "start_date"),
-    Input("date-filter", "end_date"),
-    Input("cob-filter", "value"),
-    Input("interval-update", "n_intervals"),
-    Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
-)
-def line_graph_1(start_date, end_date, cobs, n_intervals,toggle):
-
-    print(f"🔄 Atualizando dados... Intervalo: {n_intervals}")
-
-    # Agora os dados sempre serão recarregados corretamente
-    load_data(True)
-
-    # Criar uma cópia profunda para evitar modificações na variável global
-    df_filtered = df.copy(deep=True)
-
-    # Filtro de data
-    if start_date and end_date:
-        mask = (df_filtered["data"] >= start_date) & (df_filtered["data"] <= end_date)
-        df_filtered = df_filtered.loc[mask]
-
-    # Recriar a coluna 'COB_nome' se necessário
-    if 'COB_nome' not in df_filtered.columns:
-        df_filtered['COB_nome'] = df_filtered['COB'].map({
-            '1COB': '1ºCOB - RMBH/Divinóplis',
-            '2COB': '2ºCOB - Uberlândia',
-            '3COB': '3ºCOB - Juiz de Fora',
-            '4COB': '4ºCOB - Montes Claros',
-            '5COB': '5ºCOB - Governador Valadares',
-            '6COB': '6ºCOB - Varginha'
-        })
-
-    # Filtro de COBs
-    if cobs:
-        df_filtered = df_filtered[df_filtered["COB_nome"].isin(cobs)]
-
-    # Verificar novamente a presença de 'COB_nome'
-    if 'COB_nome' not in df_filtered.columns:
-        return [go.Figure().update_layout(title="Erro: Coluna 'COB_nome' não encontrada.")] * 12
-
+# Figuras ficam em cache para cada combinação de filtros e versão dos dados,
+# assim repetir um filtro não refaz as agregações nem os gráficos
+@cache.memoize(timeout=2 * intervalo_atualizacao)
+def build_figures(start_date, end_date, cobs, data_version):
 
+    # Dados já processados pela atualização em segundo plano
+    df, resumo = load_data()
 
-    # Copia profunda do Dataframe
-    df_filtered = df.copy(deep=True)
-    mask = (df_filtered["data"] >= start_date) & (df_filtered["data"] <= end_date)
-    df_filtered = df_filtered.loc[mask]
-
-    template = template_theme1 if toggle else template_theme2
-
-
-    if cobs:
-        df_filtered = df_filtered[df_filtered["COB_nome"].isin(cobs)]
+    # Filtros de data e COB aplicados ao resumo diário, de onde vêm as contagens
+    resumo_filtrado = resumo.iloc[linhas_filtradas(resumo, start_date, end_date, cobs)]
 
     # Layout do Indicadores ================================================
     # ===== Preparação dos dados para indicadores =====
-    # Filtrar ocorrências de prioridade 1 e agrupar por COB
-    prioridade_alta = df_filtered[df_filtered["Prioridade"] == "1"].groupby("COB_nome", observed=True).size().reset_index(name="Quantidade")
-
-    # Verificar se existe pelo menos um valor maior que 0
-    if not prioridade_alta.empty and prioridade_alta["Quantidade"].sum() > 0:
-        top_cob_prioridade_alta = prioridade_alta.loc[prioridade_alta["Quantidade"].idxmax()]
-        top_cob_nome = top_cob_prioridade_alta["COB_nome"]
-        top_cob_quantidade = top_cob_prioridade_alta["Quantidade"]
-        media_prioridade_alta = prioridade_alta["Quantidade"].mean()
-    else:
-        top_cob_nome = "—"  # Se não houver registros válidos, exibe "-"
-        top_cob_quantidade = 0
-        media_prioridade_alta = 0
+    # Ocorrências de prioridade 1 (filtradas uma única vez)
+    resumo_prioridade_alta = resumo_filtrado.loc[mascara_categorias(resumo_filtrado["Prioridade"], ["1"])]
+
+    # COB com maior número de ocorrências Prioridade 1 - Alta
+    top_cob_nome, top_cob_quantidade, media_prioridade_alta = top_e_media(
+        contar_ocorrencias(resumo_prioridade_alta, "COB_nome"))
 
     # Município com maior frequência de ocorrências
-    municipios_frequencia = df_filtered.groupby("municipio", observed=True).size().reset_index(name="Frequencia")
-    top_municipio = municipios_frequencia.loc[municipios_frequencia["Frequencia"].idxmax()]
-    media_frequencia_municipio = municipios_frequencia["Frequencia"].mean()
+    top_municipio, top_municipio_frequencia, media_frequencia_municipio = top_e_media(
+        contar_ocorrencias(resumo_filtrado, "municipio"))
+
+    # Ocorrências e recursos empenhados por unidade (um único agrupamento)
+    unidades = somar_por_categorias(resumo_filtrado, ["UNIDADE"], ["Quantidade", "TotalRecursos"]).set_index("UNIDADE")
 
     # Unidade com maior número de ocorrências
-    unidades_ocorrencias = df_filtered.groupby("UNIDADE", observed=True).size().reset_index(name="Quantidade")
-    top_unidade = unidades_ocorrencias.loc[unidades_ocorrencias["Quantidade"].idxmax()]
-    media_unidade = unidades_ocorrencias["Quantidade"].mean()
+    top_unidade, top_unidade_ocorrencias, media_unidade = top_e_media(unidades["Quantidade"])
 
     # Unidade com maior número de ocorrências Prioridade 1 - Alta
-    # Filtrar ocorrências de prioridade 1 e agrupar por Unidade
-    unidade_prioridade_alta = df_filtered[df_filtered["Prioridade"] == "1"].groupby("UNIDADE", observed=True).size().reset_index(name="Quantidade")
-
-    # Verificar se existe pelo menos um valor maior que 0
-    if not unidade_prioridade_alta.empty and unidade_prioridade_alta["Quantidade"].sum() > 0:
-        top_unidade_prioridade_alta = unidade_prioridade_alta.loc[unidade_prioridade_alta["Quantidade"].idxmax()]
-        top_unidade_nome = top_unidade_prioridade_alta["UNIDADE"]
-        top_unidade_quantidade = top_unidade_prioridade_alta["Quantidade"]
-        media_unidade_prioridade_alta = unidade_prioridade_alta["Quantidade"].mean()
-    else:
-        top_unidade_nome = "—"  # Se não houver registros válidos, exibe "-"
-        top_unidade_quantidade = 0
-        media_unidade_prioridade_alta = 0
+    top_unidade_nome, top_unidade_quantidade, media_unidade_prioridade_alta = top_e_media(
+        contar_ocorrencias(resumo_prioridade_alta, "UNIDADE"))
 
     # Unidade com maior número de recursos empenhados
-    recursos_empenhados = df_filtered.groupby("UNIDADE", observed=True)["total_vtr"].sum().reset_index(name="TotalRecursos")
-    top_recursos = recursos_empenhados.loc[recursos_empenhados["TotalRecursos"].idxmax()]
-    media_recursos = recursos_empenhados["TotalRecursos"].mean()
-
-    # Expandir os recursos empenhados em coordenadas separadas
-    recursos = []
-    for _, row in df.iterrows():
-        for recurso in row["recursos_empenhados"].split(" / "):
-            recursos.append({
-                "latitude": row["latitude"],
-                "longitude": row["longitude"],
-                "recurso": recurso,
-                "local": row["local_fato"]
-            })
-    df_recursos = pd.DataFrame(recursos)
-    # ===== Graficos =====
+    top_recursos, top_recursos_total, media_recursos = top_e_media(unidades["TotalRecursos"])
 
-    # Conjunto de todas as viaturas únicas
-    total_viaturas = set()
-    df_filtered['recursos_empenhados'].str.split(' / ').apply(total_viaturas.update)
+    # ===== Graficos =====
 
-    # Total de recursos existentes
-    total_recursos_unicos = len(total_viaturas)
+    # Total de recursos existentes (viaturas únicas)
+    # Única contagem que precisa das ocorrências e não cabe no resumo
+    viaturas = df["viaturas"].iloc[linhas_filtradas(df, start_date, end_date, cobs)]
+    total_recursos_unicos = contar_viaturas_unicas(viaturas)
 
     # Total de Ocorrencias existentes
-    total_ocorrencias = len(df_filtered)
+    total_ocorrencias = int(resumo_filtrado["Quantidade"].sum())
 
     # ===== Indicadores =====
 
     # Criar indicador
-    fig1 = go.Figure(go.Indicator(
-        mode='number+delta',
-        title={
-            "text": f"<span>{top_cob_nome} - Top COB</span><br>"
-                    f"<span style='font-size:90%'>Maior Prioridade 1 - Alta</span>"
-        },
-        value=top_cob_quantidade,
-        number={'suffix': " ocorrências", 'font': {'size': 40}},
-        delta={'relative': True, 'valueformat': '.1%', 'reference': media_prioridade_alta, 'position': "bottom", 'font': {'size': 30}}
-    ))
-    fig1.update_layout(template=template)
+    fig1 = figura_indicador(
+        f"<span>{top_cob_nome} - Top COB</span><br>"
+        f"<span style='font-size:90%'>Maior Prioridade 1 - Alta</span>",
+        top_cob_quantidade, " ocorrências", referencia=media_prioridade_alta)
 
     # Indicator 2: Município com maior frequência de ocorrências
-    fig2 = go.Figure(go.Indicator(
-        mode='number+delta',
-        title={
-            "text": f"<span>{top_municipio['municipio']} - Top Município</span><br>"
-                    f"<span style='font-size:90%'>Mais frequente</span>"
-        },
-        value=top_municipio["Frequencia"],
-        number={'suffix': " ocorrências", 'font': {'size': 40}},
-        delta={'relative': True, 'valueformat': '.1%', 'reference': media_frequencia_municipio, 'position': "bottom", 'font': {'size': 30}}
-    ))
-    fig2.update_layout(template=template)
+    fig2 = figura_indicador(
+        f"<span>{top_municipio} - Top Município</span><br>"
+        f"<span style='font-size:90%'>Mais frequente</span>",
+        top_municipio_frequencia, " ocorrências", referencia=media_frequencia_municipio)
 
     # Indicator 3: Unidade com maior número de ocorrências
-    fig3 = go.Figure(go.Indicator(
-        mode='number+delta',
-        title={
-            "text": f"<span>{top_unidade['UNIDADE']} - Top Unidade</span><br>"
-                    f"<span style='font-size:90%'>Mais Ocorrências</span>"
-        },
-        value=top_unidade["Quantidade"],
-        number={'suffix': " ocorrências", 'font': {'size': 40}},
-        delta={'relative': True, 'valueformat': '.1%', 'reference': media_unidade, 'position': "bottom", 'font': {'size': 30}}
-    ))
-    fig3.update_layout(template=template)
+    fig3 = figura_indicador(
+        f"<span>{top_unidade} - Top Unidade</span><br>"
+        f"<span style='font-size:90%'>Mais Ocorrências</span>",
+        top_unidade_ocorrencias, " ocorrências", referencia=media_unidade)
 
     # Indicator 4: Unidade com maior número de ocorrências Prioridade 1 - Alta
     # Criar indicador
-    fig4 = go.Figure(go.Indicator(
-        mode='number+delta',
-        title={
-            "text": f"<span>{top_unidade_nome} - Top Unidade</span><br>"
-                    f"<span style='font-size:90%'>Maior Prioridade 1 - Alta</span>"
-        },
-        value=top_unidade_quantidade,
-        number={'suffix': " ocorrências", 'font': {'size': 40}},
-        delta={'relative': True, 'valueformat': '.1%', 'reference': media_unidade_prioridade_alta, 'position': "bottom", 'font': {'size': 30}}
-    ))
-    fig4.update_layout(template=template)
+    fig4 = figura_indicador(
+        f"<span>{top_unidade_nome} - Top Unidade</span><br>"
+        f"<span style='font-size:90%'>Maior Prioridade 1 - Alta</span>",
+        top_unidade_quantidade, " ocorrências", referencia=media_unidade_prioridade_alta)
 
     # Indicator 5: Unidade com maior número de recursos empenhados
-    fig5 = go.Figure(go.Indicator(
-        mode='number+delta',
-        title={
-            "text": f"<span>{top_recursos['UNIDADE']} - Top Unidade</span><br>"
-                    f"<span style='font-size:90%'>Mais Recursos Empenhados</span>"
-        },
-        value=top_recursos["TotalRecursos"],
-        number={'suffix': " recursos", 'font': {'size': 40}},
-        delta={'relative': True, 'valueformat': '.1%', 'reference': media_recursos, 'position': "bottom", 'font': {'size': 30}}
-    ))
-    fig5.update_layout(template=template)
+    fig5 = figura_indicador(
+        f"<span>{top_recursos} - Top Unidade</span><br>"
+        f"<span style='font-size:90%'>Mais Recursos Empenhados</span>",
+        top_recursos_total, " recursos", referencia=media_recursos)
 
     # Indicator 6: Total de recursos existentes
     # Natureza de Ocorrência que Mais Aparece
-    natureza_freq = df_filtered.groupby("Natureza", observed=True).size().reset_index(name="Frequencia")
-    top_natureza = natureza_freq.loc[natureza_freq["Frequencia"].idxmax()]
-    media_natureza = natureza_freq["Frequencia"].mean()
-
-    fig6 = go.Figure(go.Indicator(
-        mode='number+delta',
-        title={
-            "text": f"<span>{top_natureza['Natureza']} - Top Natureza</span><br>"
-                    f"<span style='font-size:90%'>Natureza mais comum</span>"
-        },
-        value=top_natureza["Frequencia"],
-        number={'suffix': " ocorrências", 'font': {'size': 40}},
-        delta={'relative': True, 'valueformat': '.1%', 'reference': media_natureza, 'position': "bottom", 'font': {'size': 30}}
-    ))
-    fig6.update_layout(template=template)
+    top_natureza, top_natureza_frequencia, media_natureza = top_e_media(
+        contar_ocorrencias(resumo_filtrado, "Natureza"))
+
+    fig6 = figura_indicador(
+        f"<span>{top_natureza} - Top Natureza</span><br>"
+        f"<span style='font-size:90%'>Natureza mais comum</span>",
+        top_natureza_frequencia, " ocorrências", referencia=media_natureza)
 
     # FILE EDIT =============================================================
 
         # Indicator 5: Unidade com maior número de recursos empenhados
-    fig7 = go.Figure(go.Indicator(
-        mode='number+delta',
-        title={
-            "text": f"<span>Total de Ocorrências Existentes</span>"
-        },
-        value=total_ocorrencias,
-        number={'suffix': " ocorrências", 'font': {'size': 40}},
-    ))
-    fig7.update_layout(template=template)
+    fig7 = figura_indicador(
+        f"<span>Total de Ocorrências Existentes</span>",
+        total_ocorrencias, " ocorrências")
 
     # Indicator 6: Total de recursos existentes
-    fig8 = go.Figure(go.Indicator(
-        mode='number',
-        title={
-            "text": "<span>Total de Recursos Existentes</span><br>"
-        },
-        value=total_recursos_unicos,
-        number={'suffix': " viaturas", 'font': {'size': 40}}
-    ))
-    fig8.update_layout(template=template)
+    fig8 = figura_indicador(
+        "<span>Total de Recursos Existentes</span><br>",
+        total_recursos_unicos, " viaturas", modo='number')
 
     # FILE EDIT =============================================================
 
     # Criação do Gráfico quantidaede de chamadas por COB e Prioridade
-    prioridade_por_cob = df_filtered.groupby(['COB_nome', 'Prioridade_nome'], observed=True).size().reset_index(name='Quantidade')
-    fig9 = px.bar(prioridade_por_cob, x='COB_nome', y='Quantidade', color='Prioridade_nome',
-                    title='Quantidade de Chamadas por Prioridade em cada COB',
-                    labels={'Quantidade': 'Número de Chamadas', 'COB_nome': 'COBs', 'Prioridade_nome': 'Prioridades'},
-                        color_discrete_sequence=['#636EFA', '#FF0000', '#00CC96'])
-    fig9.update_layout(
-        legend_title_text='Prioridades', legend=dict(traceorder='normal'), template=template)
+    prioridade_por_cob = somar_por_categorias(resumo_filtrado, ['COB_nome', 'Prioridade_nome'], ['Quantidade'])
+    fig9 = figura_barras(prioridade_por_cob, x='COB_nome', cor='Prioridade_nome',
+                    titulo='Quantidade de Chamadas por Prioridade em cada COB',
+                    rotulos={'Quantidade': 'Número de Chamadas', 'COB_nome': 'COBs', 'Prioridade_nome': 'Prioridades'},
+                        cores=['#636EFA', '#FF0000', '#00CC96'])
     
 
     # Criação de Gráfico de Pizza de Tipo de Prioridade pelo total de ocorrencias
     # Gráfico de pizza por Prioridade
-    prioridade_total = df_filtered.groupby('Prioridade_nome', observed=True).size().reset_index(name='Quantidade')
+    prioridade_total = somar_por_categorias(resumo_filtrado, ['Prioridade_nome'], ['Quantidade'])
     fig10 = px.pie(
         prioridade_total, values='Quantidade', names='Prioridade_nome',
         title='Proporção de Registros por Prioridade',
         color_discrete_sequence=['#636EFA', '#FF0000', '#00CC96']
     )
-    fig10.update_layout(template=template)
     
     # Criação do Gráfico quantidaede de chamadas por COB e Natureza
-    cob_por_natureza = df_filtered.groupby(['Natureza', 'COB_nome'], observed=True).size().reset_index(name='Quantidade')
-    fig11 = px.bar(cob_por_natureza, x='Natureza', y='Quantidade', color='COB_nome',
-                    title='Quantidade de Chamadas por Natureza em cada COB',
-                    labels={'Quantidade': 'Número de Chamadas', 'Natureza': 'Naturezas', 'COB_nome': 'COBs'},
-                        color_discrete_sequence=px.colors.qualitative.T10, template=template)
-    
-    fig11.update_layout(
-    height=600,  # Aumente a altura do gráfico
-    legend_title_text='COBs',
-    legend=dict(
-        traceorder='normal',
+    cob_por_natureza = somar_por_categorias(resumo_filtrado, ['Natureza', 'COB_nome'], ['Quantidade'])
+    fig11 = figura_barras(cob_por_natureza, x='Natureza', cor='COB_nome',
+                    titulo='Quantidade de Chamadas por Natureza em cada COB',
+                    rotulos={'Quantidade': 'Número de Chamadas', 'Natureza': 'Naturezas', 'COB_nome': 'COBs'},
+                        cores=px.colors.qualitative.T10)
+
+    fig11['layout']['height'] = 600  # Aumente a altura do gráfico
+    fig11['layout']['legend'].update(
         orientation="v",
         yanchor="top",
         y=1,
         xanchor="right",
         x=1.3
-    ),
-    template=template
     )
         
 
-    return fig1, fig2, fig3, fig4, fig5, fig6, fig7, fig8, fig9, fig10, fig11 
+    # Serializar o gráfico de pizza uma única vez; o cache guarda o dicionário
+    # pronto e o Dash não precisa percorrer o objeto Figure a cada resposta
+    # Os indicadores e os gráficos de barras já são dicionários
+    # O template fica de fora: ele é aplicado no navegador conforme o tema
+    fig10 = orjson.loads(pio.to_json(fig10))
+    fig10["layout"].pop("template", None)
+    return [fig1, fig2, fig3, fig4, fig5, fig6, fig7, fig8, fig9, fig10, fig11]
+
+
+@app.callback(
+    Output("figures-store", "data"),
+    Output("figures-key", "data"),
+    Input("date-filter", "start_date"),
+    Input("date-filter", "end_date"),
+    Input("cob-filter", "value"),
+    Input("interval-update", "n_intervals"),
+    State("figures-key", "data"),
+)
+def line_graph_1(start_date, end_date, cobs, n_intervals, chave_atual):
+
+    print(f"🔄 Atualizando dados... Intervalo: {n_intervals}")
+
+    # Lista de COBs ordenada para que a mesma seleção gere a mesma chave de cache
+    cobs = tuple(sorted(cobs or ()))
+    data_version = get_data_version()
+
+    # Se o navegador já tem as figuras destes filtros e desta versão dos dados
+    # (o caso comum nos ticks do Interval), nada é reenviado
+    chave = [start_date, end_date, list(cobs), data_version]
+    if chave == chave_atual:
+        raise PreventUpdate
+
+    return build_figures(start_date, end_date, cobs, data_version), chave
+
+
+# Troca de tema no navegador: aplica o template escolhido às figuras já
+# calculadas, sem passar pelo servidor nem refazer as agregações
+app.clientside_callback(
+    """
+    function(figuras, toggle, templates) {
+        if (!figuras) {
+            throw window.dash_clientside.PreventUpdate;
+        }
+        const template = templates[toggle ? "theme1" : "theme2"];
+        return figuras.map(function(figura) {
+            return Object.assign({}, figura, {
+                layout: Object.assign({}, figura.layout, {template: template})
+            });
+        });
+    }
+    """,
+    Output("indc_1", "figure"),
+    Output("indc_2", "figure"),
+    Output("indc_3", "figure"),
+    Output("indc_4", "figure"),
+    Output("indc_5", "figure"),
+    Output("indc_6", "figure"),
+    Output("indc_7", "figure"),
+    Output("indc_8", "figure"),
+    Output("cob_pri", "figure"),
+    Output("pri_pie", "figure"),
+    Output("cob_nat", "figure"),
+    #Output("map_priorities", "figure"),
+    Input("figures-store", "data"),
+    Input(ThemeSwitchAIO.ids.switch("theme"), "value"),
+    State("figure-templates", "data"),
+)
 
 # Rodar o servidor ================================================
 if __name__ == "__main__":